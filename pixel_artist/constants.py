@@ -1,5 +1,10 @@
 """Constants values used across the project."""
 
+CHUNK_BYTES = 8 * 1024 * 1024
+D65_WHITE = (0.95047, 1.00000, 1.08883)
 LAB = "LAB"
 RGB = "RGB"
+SRGB_TO_XYZ = ((0.412424, 0.357579, 0.180464),
+               (0.212656, 0.715158, 0.0721856),
+               (0.0193324, 0.119193, 0.950444))
 SUCCESS = 0
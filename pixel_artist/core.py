@@ -20,14 +20,29 @@ Typical usage:
 import pickle
 import pkgutil
 import sys
+from functools import lru_cache
 from typing import Tuple, Union
 
+import numpy as np
 from PIL import Image
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie1976
-from colormath.color_objects import LabColor, sRGBColor
 
-from .constants import LAB
+from .constants import CHUNK_BYTES, D65_WHITE, LAB, SRGB_TO_XYZ
+
+
+@lru_cache(maxsize=None)
+def load_palette(nbits: int) -> Tuple:
+    """Loads one of the color palettes bundled with the package.
+
+    Palettes are cached, so that each one is only read and unpickled once per process.
+
+    Args:
+      nbits: An integer specifying the number of bits of the color palette.
+
+    Returns:
+        A tuple containing the palette colors, each one a tuple of 3 color values (Red, Green, Blue).
+    """
+    palette_data = pkgutil.get_data(__name__, "palette/" + str(nbits) + "bit.palette")
+    return tuple(pickle.loads(palette_data))
 
 
 class PixelArt:
@@ -63,12 +78,21 @@ class PixelArt:
         self.palette = None
         if nbits != 24:
             try:
-                palette_data = pkgutil.get_data(__name__, "palette/" + str(self.nbits) + "bit.palette")
-                self.palette = pickle.loads(palette_data)
+                self.palette = load_palette(self.nbits)
             except Exception as e:
                 print(f"An error has occurred while loading the color palette: {e}")
                 sys.exit()
 
+        # keep the palette as an array as well, to match many colors at once
+        self.palette_array = None
+        if self.palette:
+            self.palette_array = np.asarray(self.palette, dtype=np.float64)
+
+        # convert the palette to L*ab once, instead of on every color comparison
+        self.palette_lab = None
+        if self.palette and self.color_space == LAB:
+            self.palette_lab = self.rgb_to_lab(self.palette_array)
+
         # compute image dimensions
         self.width, self.height = self.im.size[0], self.im.size[1]
         if self.verbose:
@@ -90,12 +114,7 @@ class PixelArt:
         # number of blocks
         self.nblocks = self.grid_width * self.grid_height
         if self.verbose:
-            print(f"Fetching {self.nblocks} image blocks")
-
-        # fetch all the image blocks
-        self.blocks = []
-        for i in range(int(self.nblocks)):
-            self.blocks.append(self.get_block_at_pos(i))
+            print(f"Number of blocks -> {self.nblocks}")
 
     # find the dimension
     def find_block_dim(self, dim: int) -> int:
@@ -109,21 +128,15 @@ class PixelArt:
         Returns:
             An integer representing a dimension (height or width) of the block to be used across the image.
         """
-        candidate = 0
-        block_dim = 1
-        counter = 0
-        while counter != self.granularity:  # while we dont achieve the desired granularity
-            candidate += 1
-            while dim % candidate != 0:
-                candidate += 1
-                if candidate > dim:
-                    counter = self.granularity - 1
-                    break
-
-            if candidate <= dim:
-                block_dim = candidate  # save the current feasible length
-
-            counter += 1
+        # all the divisors of dim, found by trial division up to its square root
+        divisors = set()
+        for candidate in range(1, int(dim ** 0.5) + 1):
+            if dim % candidate == 0:
+                divisors.update((candidate, dim // candidate))
+        divisors = sorted(divisors)
+
+        # the nth smallest divisor for granularity n, or the dimension itself if there are not enough divisors
+        block_dim = divisors[min(self.granularity, len(divisors)) - 1]
 
         assert (dim % block_dim == 0 and block_dim <= dim)
         return block_dim
@@ -131,29 +144,38 @@ class PixelArt:
     def pixelate(self) -> Image:
         """Main method that contains all the high-level steps to perform pixelation of the input image.
 
-        The pixelation is implemented by using a sliding block across the input image,
-        where each region defined by the sliding block is replaced by the average block color.
+        The pixelation is implemented by reducing the input image by the block dimensions,
+        so that each block becomes a single pixel with its average color, and then scaling it back to the input
+        image dimensions.
 
         Returns:
             A PIL.Image instance, representing the pixelated image .
         """
-        pixelated_im = self.im.copy()
-        for i in range(int(self.nblocks)):
-            if self.verbose:
-                print(f"Building pixelated image:  {(i / self.nblocks * 100):.2f} %", end="\r")
+        if self.verbose:
+            print(f"Building pixelated image from {self.nblocks} blocks")
 
-            # define the target box where to paste the new block
-            bbox = self.get_bbox_at_pos(i)
+        # reduce every block to a single pixel with its average color
+        grid_im = self.im.reduce((self.block_width, self.block_height))
 
-            # compute the average color of the block
-            avg_color = tuple(round(c) for c in self.avg_color(self.blocks[i]))
+        # replace each average by the closest palette color
+        if self.palette:
+            grid_pos = self.match_positions(np.asarray(grid_im))
+            used_pos, grid_indices = np.unique(grid_pos, return_inverse=True)
 
-            # paste it
-            pixelated_im.paste(avg_color, bbox)
+            # when few enough palette colors are in use, they already are the palette of the output image
+            if len(used_pos) <= self.ncolors:
+                grid_im = Image.fromarray(grid_indices.reshape(grid_pos.shape).astype(np.uint8))
+                grid_im.putpalette(self.palette_array[used_pos].astype(np.uint8).ravel().tolist())
+                return grid_im.resize((self.width, self.height), Image.NEAREST)
 
-        if self.verbose:
-            print()
-        pixelated_im = pixelated_im.convert("P", palette=Image.ADAPTIVE, colors=self.ncolors)
+            grid_im = Image.fromarray(self.palette_array[grid_pos].astype(np.uint8))
+
+        # quantize before scaling: every block color is repeated block_width * block_height times in the
+        # full size image, so the adaptive palette is the same but it is computed over far fewer pixels
+        grid_im = grid_im.convert("P", palette=Image.ADAPTIVE, colors=self.ncolors)
+
+        # scale each block color back to the block dimensions
+        pixelated_im = grid_im.resize((self.width, self.height), Image.NEAREST)
         return pixelated_im
 
     # get the block at the ith position of the image
@@ -193,37 +215,103 @@ class PixelArt:
 
         return bbox
 
-    def avg_color(self, im: Image) -> Tuple:
+    def avg_color(self, im: Union[Image.Image, np.ndarray]) -> Tuple:
         """Computes the average color of an image.
 
         Args:
-          im: A PIL.Image containing the image used to compute the average color.
+          im: A PIL.Image, or a numpy array of shape (height, width, channels) such as a view of an image region,
+          containing the image used to compute the average color.
 
         Returns:
             A tuple containing the 3 color values (Red, Green, Blue) representing the average color of the given image.
+
+        Raises:
+            ValueError: If the image does not have a channel dimension, such as a grayscale image.
         """
-        avg_r = avg_g = avg_b = 0.0
-        pixels = im.getdata()
-        size = len(pixels)
+        pixels = np.asarray(im)
+        if pixels.ndim != 3:
+            raise ValueError(f"Expected an image of shape (height, width, channels), got shape {pixels.shape}")
 
-        for p in pixels:
-            avg_r += p[0] / size
-            avg_g += p[1] / size
-            avg_b += p[2] / size
+        # reduce all the pixels at once, in native code
+        avg_r, avg_g, avg_b = pixels.reshape(-1, pixels.shape[-1]).mean(axis=0)[:3].tolist()
 
         if self.palette:
-            best_color = self.palette[0]
-            best_diff = self.colordiff(best_color, (avg_r, avg_g, avg_b))
-            for i in range(1, len(self.palette)):
-                candidate_diff = self.colordiff(self.palette[i], (avg_r, avg_g, avg_b))
-                if candidate_diff < best_diff:
-                    best_diff = candidate_diff
-                    best_color = self.palette[i]
-
-            return best_color
+            return self.best_color((avg_r, avg_g, avg_b))
         else:
             return avg_r, avg_g, avg_b
 
+    def best_color(self, color: Tuple) -> Tuple:
+        """Finds the palette color closest to a given color.
+
+        Args:
+          color: A tuple containing the color values (Red, Green, Blue) to be matched against the palette.
+
+        Returns:
+            A tuple containing the 3 color values (Red, Green, Blue) of the closest palette color.
+        """
+        best_pos = self.best_positions(np.asarray([color], dtype=np.float64))[0]
+        return self.palette[best_pos]
+
+    def match_positions(self, colors: np.ndarray) -> np.ndarray:
+        """Finds the palette positions of the palette colors closest to each one of the given colors.
+
+        Repeated colors, such as the ones from the blocks of large flat regions, are only matched once.
+
+        Args:
+          colors: A numpy array whose last dimension contains the color values (Red, Green, Blue) to be matched.
+
+        Returns:
+            A numpy array with the shape of colors without its last dimension, containing the palette positions.
+        """
+        flat_colors = colors.reshape(-1, 3)
+        if flat_colors.dtype == np.uint8:
+            # pack each 8 bit color into a single integer, which is much faster to deduplicate than rows
+            channels = flat_colors.astype(np.uint32)
+            keys = (channels[:, 0] << 16) | (channels[:, 1] << 8) | channels[:, 2]
+            _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            unique_colors = flat_colors[index]
+        else:
+            unique_colors, inverse = np.unique(flat_colors, axis=0, return_inverse=True)
+
+        best_pos = self.best_positions(unique_colors)[inverse.reshape(-1)]
+        return best_pos.reshape(colors.shape[:-1])
+
+    def best_positions(self, colors: np.ndarray) -> np.ndarray:
+        """Finds the positions, in the palette, of the palette colors closest to each one of the given colors.
+
+        The squared color differences are expanded as |c|^2 - 2 c.p + |p|^2, so that the whole palette is compared
+        against a chunk of colors with a single matrix product. The |c|^2 term is the same for every palette color
+        and is left out, since it does not change which palette color is the closest.
+
+        Args:
+          colors: A numpy array of shape (N, 3) containing the color values (Red, Green, Blue) to be matched.
+
+        Returns:
+            A numpy array of shape (N,) containing the palette positions of the closest colors.
+        """
+        candidates = self.palette_array
+        if self.palette_lab is not None:
+            candidates = self.palette_lab
+        elif colors.dtype == np.uint8:
+            # distances between 8 bit RGB colors stay below 2^24, so they are exact in single precision
+            candidates = candidates.astype(np.float32)
+        candidate_norms = (candidates ** 2).sum(axis=1)
+
+        best_pos = np.empty(len(colors), dtype=np.intp)
+        chunk_size = max(1, CHUNK_BYTES // (len(candidates) * candidates.itemsize))
+        for start in range(0, len(colors), chunk_size):
+            chunk = colors[start:start + chunk_size]
+            if self.palette_lab is not None:
+                chunk = self.rgb_to_lab(chunk)
+            else:
+                chunk = chunk.astype(candidates.dtype)
+
+            # squared differences preserve the ordering of both the RGB and the Lab* (delta e 1976) distances
+            diffs = candidate_norms - 2 * (chunk @ candidates.T)
+            best_pos[start:start + chunk_size] = diffs.argmin(axis=1)
+
+        return best_pos
+
     def colordiff(self, pixel1: Tuple, pixel2: Tuple) -> Union[int, float]:
         """Computes the difference between two pixels, defined by their respective color values.
 
@@ -273,15 +361,36 @@ class PixelArt:
           pixel2: A tuple containing another pixel value.
 
         Returns:
-            A float value representing the color difference between the two pixels.
+            A float value representing the color difference (delta e CIE 1976) between the two pixels.
         """
         # convert rgb values to L*ab values
-        rgb_pixel_source = sRGBColor(pixel1[0], pixel1[1], pixel1[2], True)
-        lab_source = convert_color(rgb_pixel_source, LabColor)
-
-        rgb_pixel_palette = sRGBColor(pixel2[0], pixel2[1], pixel2[2], True)
-        lab_palette = convert_color(rgb_pixel_palette, LabColor)
+        lab_source, lab_palette = PixelArt.rgb_to_lab(np.asarray([pixel1, pixel2], dtype=np.float64))
 
         # calculate delta e
-        delta_e = delta_e_cie1976(lab_source, lab_palette)
+        delta_e = float(np.linalg.norm(lab_source - lab_palette))
         return delta_e
+
+    @staticmethod
+    def rgb_to_lab(pixels: np.ndarray) -> np.ndarray:
+        """Converts pixels from the sRGB color space to the Lab* color space, under the D65 illuminant.
+
+        Args:
+          pixels: A numpy array whose last dimension contains the pixel values (Red, Green, Blue), between 0 and 255.
+
+        Returns:
+            A numpy array with the same shape as pixels, containing the (L*, a*, b*) values.
+        """
+        # linearize the gamma encoded values
+        rgb = pixels / 255
+        rgb = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+        # linear rgb to xyz, normalized by the reference white
+        xyz = rgb @ np.transpose(SRGB_TO_XYZ) / D65_WHITE
+
+        # xyz to L*ab
+        f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+        lab = np.empty_like(f)
+        lab[..., 0] = 116 * f[..., 1] - 16
+        lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+        lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+        return lab
@@ -17,8 +17,8 @@ def _load_module_from_src(mod_name, mod_fname, pkg_dir=""):
 
 about = _load_module_from_src("about", "__about__", "pixel_artist")
 install_requires = [
-    "Pillow==9.0.1",
-    "colormath==3.0.0"
+    "numpy==1.22.2",
+    "Pillow==9.0.1"
 ]
 
 test_requires = []
@@ -42,7 +42,7 @@ setup(
             'pixel-artist = pixel_artist.__main__:main',
         ],
     },
-    python_requires=">=3.6",
+    python_requires=">=3.8",
     include_package_data=True,
     install_requires=install_requires,
     test_requires=test_requires,
@@ -60,7 +60,6 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3 :: Only",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: Implementation :: CPython",